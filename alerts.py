@@ -0,0 +1,341 @@
+# Dependences
+import fcntl
+import json
+import math
+import os
+import numpy as np
+import requests as req
+from abc import ABC, abstractmethod
+from threading import Lock
+from time import time
+
+
+# Streaming statistics
+class RunningStats():
+    """
+    Welford's online mean / variance, O(1) per point.
+    """
+    __slots__ = ('n', 'mean', 'm2')
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def push(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self) -> float:
+        if self.n < 2:
+            return 0.0
+        return math.sqrt(self.m2 / (self.n - 1))
+
+
+# Rules
+class Rule(ABC):
+    """
+    A rule watches a single metric and is fed its points in time order.
+    `evaluate` returns a message when the latest point breaks the rule,
+    or None when it is healthy.
+    """
+
+    def __init__(self, name: str, metric: str):
+        self.name = name
+        self.metric = metric
+
+    @abstractmethod
+    def evaluate(self, value: float):
+        pass
+
+    # Rules that keep state between points persist it through these
+    def state(self) -> dict:
+        return {}
+
+    def load_state(self, state: dict):
+        pass
+
+
+class ThresholdRule(Rule):
+    def __init__(self, name: str, metric: str, above: float = None, below: float = None):
+        super().__init__(name, metric)
+        self.above = above
+        self.below = below
+
+    def evaluate(self, value):
+        if self.above is not None and value > self.above:
+            return f"{self.metric} = {value:.4g} is above {self.above:.4g}"
+        if self.below is not None and value < self.below:
+            return f"{self.metric} = {value:.4g} is below {self.below:.4g}"
+        return None
+
+
+class RateOfChangeRule(Rule):
+    """
+    Relative change between consecutive points, eg. `max_drop=0.2` fires
+    when a point is more than 20% lower than the previous one.
+    """
+
+    def __init__(self, name: str, metric: str, max_drop: float = None, max_rise: float = None):
+        super().__init__(name, metric)
+        self.max_drop = max_drop
+        self.max_rise = max_rise
+        self.previous = None
+
+    def evaluate(self, value):
+        previous, self.previous = self.previous, value
+        if previous is None or previous == 0:
+            return None
+        change = (value - previous) / abs(previous)
+        if self.max_drop is not None and change < -self.max_drop:
+            return f"{self.metric} dropped {-change:.1%} to {value:.4g}"
+        if self.max_rise is not None and change > self.max_rise:
+            return f"{self.metric} rose {change:.1%} to {value:.4g}"
+        return None
+
+
+    def state(self):
+        return {'previous': self.previous}
+
+    def load_state(self, state):
+        self.previous = state['previous']
+
+
+class ZScoreRule(Rule):
+    """
+    Compares each point against the running mean / std of all the points
+    seen before it. `direction` is one of 'above', 'below' or 'both'.
+    """
+
+    def __init__(self, name: str, metric: str, threshold: float = 3.0,
+                 direction: str = 'both', min_points: int = 24):
+        super().__init__(name, metric)
+        self.threshold = threshold
+        self.direction = direction
+        self.min_points = min_points
+        self.stats = RunningStats()
+
+    def evaluate(self, value):
+        stats = self.stats
+        message = None
+        if stats.n >= self.min_points and stats.std > 0:
+            z = (value - stats.mean) / stats.std
+            if self.direction in ('above', 'both') and z > self.threshold:
+                message = f"{self.metric} = {value:.4g} is {z:.1f} std above the mean"
+            if self.direction in ('below', 'both') and z < -self.threshold:
+                message = f"{self.metric} = {value:.4g} is {-z:.1f} std below the mean"
+        stats.push(value)
+        return message
+
+    def state(self):
+        return {'n': self.stats.n, 'mean': self.stats.mean, 'm2': self.stats.m2}
+
+    def load_state(self, state):
+        self.stats.n = state['n']
+        self.stats.mean = state['mean']
+        self.stats.m2 = state['m2']
+
+
+# Sinks
+class WebhookSink():
+    def __init__(self, url: str, timeout: float = 10):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, alert: dict):
+        try:
+            req.post(self.url,
+                     data=json.dumps(alert),
+                     headers={'Content-Type': 'application/json'},
+                     timeout=self.timeout)
+        except req.RequestException as e:
+            print(f"Webhook {self.url} failed: {e}")
+
+
+class LocalSink():
+    """
+    Keeps the sent alerts in memory, for local runs and tests.
+    """
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, alert: dict):
+        self.sent.append(alert)
+
+
+# Engine
+class AlertEngine():
+    """
+    Feeds only the points newer than the last seen one for each metric
+    into the rules, so a refresh costs O(new points) rule evaluations.
+    The newest point of a series is its bucket still filling, so it is
+    held back until a newer point arrives.
+    Sinks are notified whenever a rule starts or stops firing.
+
+    With a `state_path`, the state is kept on disk so a restart picks up
+    where it stopped. Every gunicorn worker runs its own engine, so only
+    the one holding the lock next to the state file saves it and notifies
+    the sinks; the others take over if it goes away.
+    """
+
+    def __init__(self, rules: list, sinks: list = (), source: str = None,
+                 state_path: str = None):
+        self.source = source
+        self.rules = {}
+        for rule in rules:
+            self.rules.setdefault(rule.metric, []).append(rule)
+        self.sinks = list(sinks)
+        self.last_time = {}
+        self.firing = {}
+        self.lock = Lock()
+        self.state_path = state_path
+        self._lock_file = None
+        self.leader = self._try_lead()
+        self._load_state()
+
+    def _try_lead(self) -> bool:
+        if self.state_path is None:
+            return True
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        fid = open(f"{self.state_path}.lock", 'a')
+        try:
+            fcntl.flock(fid, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fid.close()
+            return False
+        self._lock_file = fid
+        return True
+
+    def _load_state(self):
+        if self.state_path is None or not os.path.exists(self.state_path):
+            return
+        with open(self.state_path, 'r') as fid:
+            state = json.load(fid)
+        self.last_time = {metric: _decode_time(t) for metric, t in state['last_time'].items()}
+        self.firing = state['firing']
+        for rules in self.rules.values():
+            for rule in rules:
+                if rule.name in state['rules']:
+                    rule.load_state(state['rules'][rule.name])
+
+    def _save_state(self):
+        state = {'last_time': {metric: _encode_time(t) for metric, t in self.last_time.items()},
+                 'firing': self.firing,
+                 'rules': {rule.name: rule.state()
+                           for rules in self.rules.values() for rule in rules}}
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as fid:
+            json.dump(state, fid)
+        os.replace(tmp_path, self.state_path)
+
+    def observe(self, metric: str, times, values):
+        rules = self.rules.get(metric)
+        if rules is None:
+            return
+        times = np.asarray(times)
+        values = np.asarray(values, dtype='float64')
+        mask = ~np.isnan(values)
+        if np.issubdtype(times.dtype, np.datetime64):
+            mask &= ~np.isnat(times)
+        if not mask.any():
+            return
+        # Leave out the open bucket
+        mask &= times < times[mask].max()
+
+        alerts = []
+        with self.lock:
+            if not self.leader and self._try_lead():
+                self.leader = True
+                self._load_state()
+            last_time = self.last_time.get(metric)
+            if last_time is not None:
+                mask &= times > last_time
+            if not mask.any():
+                return
+            order = np.argsort(times[mask], kind='stable')
+            points = list(zip(times[mask][order], values[mask][order]))
+            # The history loaded on the first refresh only sets the state
+            notify = last_time is not None and self.leader
+            for rule in rules:
+                for t, v in points:
+                    message = rule.evaluate(float(v))
+                    alert = self._set_state(rule, t, v, message)
+                    if notify and alert is not None:
+                        alerts.append(alert)
+            self.last_time[metric] = points[-1][0]
+            if self.leader and self.state_path is not None:
+                self._save_state()
+
+        # Sinks can be slow, so they are called without holding the lock
+        for alert in alerts:
+            self._notify(alert)
+
+    def observe_figure(self, name: str, fig):
+        """
+        Every series of a `CompactFigure` is a metric named `<figure>.<series>`.
+        """
+        for series_name, x, values in fig.series():
+            self.observe(f"{name}.{series_name}", x, values)
+
+    def _set_state(self, rule: Rule, t, v, message):
+        """
+        Returns the alert to be sent when the rule starts or stops firing.
+        """
+        was_firing = rule.name in self.firing
+        if message is not None:
+            alert = {'rule': rule.name,
+                     'source': self.source,
+                     'metric': rule.metric,
+                     'status': 'firing',
+                     'message': message,
+                     'time': str(t),
+                     'value': float(v),
+                     'since': self.firing[rule.name]['since'] if was_firing else time()}
+            self.firing[rule.name] = alert
+            return None if was_firing else alert
+        elif was_firing:
+            return dict(self.firing.pop(rule.name),
+                        status='resolved', time=str(t), value=float(v))
+        return None
+
+    def _notify(self, alert: dict):
+        for sink in self.sinks:
+            sink.send(alert)
+
+    def firing_alerts(self) -> list:
+        with self.lock:
+            return list(self.firing.values())
+
+
+def _encode_time(t) -> list:
+    if isinstance(t, np.datetime64):
+        return ['datetime64', str(t)]
+    return ['int', int(t)]
+
+
+def _decode_time(t: list):
+    kind, value = t
+    return np.datetime64(value) if kind == 'datetime64' else np.int64(value)
+
+
+# Default rules for the series behind `figures.FIGURES_FUNCTIONS`. Rules keep
+# state, so each engine gets its own instances.
+def default_rules() -> list:
+    return [
+        ThresholdRule('qa_power_shrinking',
+                      'qa_power_velocity_estimate.velocity_estimate',
+                      below=0.0),
+        ZScoreRule('qa_power_velocity_collapse',
+                   'qa_power_velocity_estimate.velocity_estimate',
+                   threshold=4.0, direction='below'),
+        ZScoreRule('terminated_deals_spike',
+                   'number_of_terminated_deals.number_of_terminated_deals',
+                   threshold=4.0, direction='above', min_points=7),
+        RateOfChangeRule('reward_position_estimate_drop',
+                         'per_epoch_reward_estimate.per_epoch_reward_position_estimate',
+                         max_drop=0.05),
+    ]
@@ -0,0 +1,110 @@
+# Dependences
+import argparse
+import os
+from multiprocessing import Pool, Semaphore
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import NullPool
+from time import time
+import rollups
+from sources import load_sources
+
+# Epochs behind the head that are not backfilled, as they can still be reorged
+FINALITY = 900
+
+# Set on each worker by `init_worker`
+worker_engine = None
+worker_semaphore = None
+
+
+def init_worker(conn_string: str, semaphore):
+    global worker_engine, worker_semaphore
+    # No pool, so a worker only holds a connection while it runs a query
+    worker_engine = create_engine(conn_string, poolclass=NullPool)
+    worker_semaphore = semaphore
+
+
+def run_partition(task: tuple) -> tuple:
+    metric, start, end = task
+    with worker_semaphore:
+        t1 = time()
+        with worker_engine.connect() as connection:
+            df = rollups.query_partition(connection, metric, start, end)
+        t2 = time()
+    return metric, start, end, df, t2 - t1
+
+
+def chain_head(conn_string: str) -> int:
+    with create_engine(conn_string).connect() as connection:
+        return connection.execute(text("SELECT MAX(height) FROM block_headers")).scalar()
+
+
+def partitions(start: int, end: int, size: int) -> list:
+    return [(s, min(s + size, end)) for s in range(start, end, size)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Backfill the hourly rollups from Sentinel by epoch-range partitions.')
+    parser.add_argument('--metrics', nargs='+', default=list(rollups.ROLLUP_QUERIES),
+                        choices=list(rollups.ROLLUP_QUERIES))
+    parser.add_argument('--start', type=int, default=0,
+                        help='First epoch (default: genesis)')
+    parser.add_argument('--end', type=int, default=None,
+                        help=f'Last epoch, exclusive (default: chain head - {FINALITY})')
+    parser.add_argument('--partition-epochs', type=int, default=7 * 24 * rollups.EPOCHS_PER_HOUR,
+                        help='Epochs per partition (default: one week)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Processes in the pool')
+    parser.add_argument('--max-connections', type=int, default=4,
+                        help='Maximum concurrent connections to Sentinel')
+    parser.add_argument('--source', default=None,
+                        help='Source on config/sources.json (default: the first one)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for name in ('start', 'partition_epochs'):
+        if getattr(args, name) % rollups.EPOCHS_PER_HOUR != 0:
+            raise SystemExit(f"--{name.replace('_', '-')} must be a multiple of "
+                             f"{rollups.EPOCHS_PER_HOUR} epochs")
+
+    sources = load_sources()
+    source = sources[args.source or next(iter(sources))]
+    conn_string = source.conn_string
+
+    end = args.end
+    if end is None:
+        end = chain_head(conn_string) - FINALITY
+    # Only whole hourly buckets are stored
+    end -= end % rollups.EPOCHS_PER_HOUR
+
+    store = rollups.store_engine(source.rollup_path)
+    tasks = []
+    for metric in args.metrics:
+        done = set(rollups.completed_partitions(store, metric))
+        tasks += [(metric, s, e)
+                  for s, e in partitions(args.start, end, args.partition_epochs)
+                  if (s, e) not in done]
+
+    if len(tasks) == 0:
+        print("Nothing to backfill")
+        return
+    print(f"Backfilling {len(tasks)} partitions of {source.name} epochs {args.start} to {end}")
+
+    semaphore = Semaphore(args.max_connections)
+    total_epochs = 0
+    t1 = time()
+    with Pool(args.workers, initializer=init_worker, initargs=(conn_string, semaphore)) as pool:
+        for i, (metric, s, e, df, seconds) in enumerate(pool.imap_unordered(run_partition, tasks)):
+            rollups.store_partition(store, metric, s, e, df, seconds)
+            total_epochs += e - s
+            print(f"[{i + 1}/{len(tasks)}] {metric} {s}-{e}: "
+                  f"{len(df)} rows, {(e - s) / max(seconds, 1e-3):.0f} epochs/s")
+    t2 = time()
+    print(f"Backfilled {total_epochs} epochs in {t2 - t1:.1f}s "
+          f"({total_epochs / (t2 - t1):.0f} epochs/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,33 +2,41 @@
 
 # Dependences
 import json
+import os
+import resource
 import requests as req
-import plotly.express as px
 import pandas as pd
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 from time import time
+from alerts import AlertEngine, WebhookSink, default_rules
+from series_store import compact_line, SeriesStore
+from sources import load_sources
 
-# Prepare SQL connection string to be used on the functions
-CONN_STRING_PATH = 'config/sentinel-conn-string.txt'
+# Optional webhook to be notified when an alert starts or stops firing
+ALERT_WEBHOOK_PATH = 'config/alert-webhook-url.txt'
 
-with open(CONN_STRING_PATH, 'r') as fid:
-    conn_string = fid.read()
+if os.path.exists(ALERT_WEBHOOK_PATH):
+    with open(ALERT_WEBHOOK_PATH, 'r') as fid:
+        ALERT_SINKS = [WebhookSink(fid.read().strip())]
+else:
+    ALERT_SINKS = []
 
 
 def simple_time_series(fig_df: pd.DataFrame, VIZ_PARAMS: dict):
     if len(fig_df) > 0:
-        fig = px.line(fig_df,
-                      x='time',
-                      y='value',
-                      **VIZ_PARAMS
-                      )
+        fig = compact_line(fig_df,
+                           x='time',
+                           y='value',
+                           **VIZ_PARAMS
+                           )
     else:
         fig = None
     return fig
 
 
 # Visualizations
-def relative_token_distribution(connection):
+def relative_token_distribution(source):
     QUERY = """
             WITH td AS (
                 SELECT 
@@ -67,25 +75,22 @@ def relative_token_distribution(connection):
             ORDER BY timestamp
             """
 
-    df = (pd.read_sql(QUERY, connection)
+    df = (source.read_sql(QUERY)
           )
 
-    fig_df = df.melt(id_vars=['timestamp'])
-    if len(fig_df) > 0:
-        fig = px.line(fig_df,
-                      x='timestamp',
-                      y='value',
-                      color='variable',
-                      title='Relative token distribution',
-                      labels={'value': '% of FIL supply',
-                              'timestamp': 'Timestamp',
-                              'variable': 'Token status'})
+    if len(df) > 0:
+        fig = compact_line(df,
+                           x='timestamp',
+                           title='Relative token distribution',
+                           labels={'value': '% of FIL supply',
+                                   'timestamp': 'Timestamp',
+                                   'variable': 'Token status'})
     else:
         fig = None
     return fig
 
 
-def absolute_token_distribution(connection):
+def absolute_token_distribution(source):
     QUERY = """
             WITH td AS (
                 SELECT 
@@ -113,43 +118,54 @@ def absolute_token_distribution(connection):
             ORDER BY time
             """
 
-    df = (pd.read_sql(QUERY, connection)
+    df = (source.read_sql(QUERY)
             .assign(time=lambda df: pd.to_datetime(df.time, unit='ms'))
           )
 
-    fig_df = df.melt(id_vars=['time'])
-
-    if len(fig_df) > 0:
-        fig = px.line(fig_df,
-                      x='time',
-                      y='value',
-                      color='variable',
-                      title='Absolute token distribution',
-                      labels={'value': 'FIL',
-                              'time': 'Timestamp',
-                              'variable': 'Token status'})
+    if len(df) > 0:
+        fig = compact_line(df,
+                           x='time',
+                           title='Absolute token distribution',
+                           labels={'value': 'FIL',
+                                   'time': 'Timestamp',
+                                   'variable': 'Token status'})
     else:
         fig = None
     return fig
 
 
-def fil_price(connection):
-    r = req.get(
-        'https://api.coingecko.com/api/v3/coins/filecoin/market_chart?vs_currency=usd&days=max')
-    d = json.loads(r.content)['prices']
-    fig_df = (pd.DataFrame(d, columns=['timestamp', 'price'])
-                .assign(timestamp=lambda df: pd.to_datetime(df.timestamp, unit='ms')))
+# The price is the same for every source, so it is fetched once per refresh
+# cycle and shared between them
+FIL_PRICE_TTL = 600
+_fil_price = {'df': None, 'time': 0}
+_fil_price_lock = Lock()
+
+
+def fil_price_df():
+    with _fil_price_lock:
+        if _fil_price['df'] is None or time() - _fil_price['time'] > FIL_PRICE_TTL:
+            r = req.get(
+                'https://api.coingecko.com/api/v3/coins/filecoin/market_chart?vs_currency=usd&days=max')
+            d = json.loads(r.content)['prices']
+            _fil_price['df'] = (pd.DataFrame(d, columns=['timestamp', 'price'])
+                                  .assign(timestamp=lambda df: pd.to_datetime(df.timestamp, unit='ms')))
+            _fil_price['time'] = time()
+        return _fil_price['df']
 
-    fig = px.line(fig_df.query('timestamp > "2020-09-01"'),
-                  x='timestamp',
-                  y='price',
-                  title='Historical Filecoin price in USD',
-                  labels={'timestamp': 'Timestamp',
-                          'price': 'FIL / USD'})
+
+def fil_price(source):
+    fig_df = fil_price_df()
+
+    fig = compact_line(fig_df.query('timestamp > "2020-09-01"'),
+                       x='timestamp',
+                       y='price',
+                       title='Historical Filecoin price in USD',
+                       labels={'timestamp': 'Timestamp',
+                               'price': 'FIL / USD'})
     return fig
 
 
-def reward_vesting_per_day(connection):
+def reward_vesting_per_day(source):
     query = """
     SELECT ce.circulating_fil::NUMERIC / 1e18 AS circulating_fil,
             ce.vested_fil::NUMERIC / 1e18 AS vested_fil,
@@ -169,7 +185,7 @@ def reward_vesting_per_day(connection):
     ORDER by timestamp ASC
     """
 
-    df = (pd.read_sql(query, connection)
+    df = (source.read_sql(query)
             .assign(timestamp=lambda df: pd.to_datetime(df.timestamp, unit='s'))
             .set_index('timestamp')
             .sort_index()
@@ -199,214 +215,124 @@ def reward_vesting_per_day(connection):
                 .assign(vested_fil_per_gb=lambda df: df.new_miner_vested_fil))
 
     if len(daily_df) > 0:
-        fig = px.line(daily_df,
-                      x=daily_df.index,
-                      y=daily_df.new_miner_vested_fil,
-                      title=r"new_miner_vested / new_ip, daily",
-                      log_y=True)
+        fig = compact_line(daily_df.reset_index(),
+                           x='timestamp',
+                           y='new_miner_vested_fil',
+                           title=r"new_miner_vested / new_ip, daily",
+                           log_y=True)
     else:
         fig = None
     return fig
 
 
-def absolute_qa_power_distribution(connection):
-    QUERY = """
-        SELECT 
-        AVG(total_qa_bytes_power::numeric) * 2^(-50) AS total_power,
-        AVG(total_qa_bytes_committed::numeric) * 2^(-50) as total_committed,
-        AVG(qa_smoothed_position_estimate::numeric) * 2^(-128) * 2^(-50) AS position_estimate,
-        MIN(bh.timestamp) AS time
-        FROM chain_powers cp
-        LEFT JOIN block_headers bh
-        ON bh.parent_state_root = cp.state_root
-        GROUP BY date_trunc('hour',  to_timestamp(bh.timestamp))
-            """
-
-    df = (pd.read_sql(QUERY, connection)
+def absolute_qa_power_distribution(source):
+    df = (source.hourly_rollup('absolute_qa_power_distribution')
             .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
 
-    fig_df = df.melt(id_vars=['time'])
-    fig = px.line(fig_df,
-                  x='time',
-                  y='value',
-                  color='variable',
-                  title='QA Power distribution',
-                  labels={'value': 'Filwatts',
-                          'time': 'Timestamp',
-                          'variable': 'Metric'})
+    fig = compact_line(df,
+                       x='time',
+                       title='QA Power distribution',
+                       labels={'value': 'Filwatts',
+                               'time': 'Timestamp',
+                               'variable': 'Metric'},
+                       epoch='epoch')
     return fig
 
 
-def network_RB_power_distribution(connection):
-    QUERY = """
-        SELECT 
-        avg(total_raw_bytes_power::numeric) * 2^(-50) AS total_power,
-        avg(total_raw_bytes_committed::numeric) * 2^(-50) AS total_committed,
-        min(bh.timestamp) AS time
-        FROM chain_powers cp
-        LEFT JOIN block_headers bh
-        ON bh.parent_state_root = cp.state_root
-        GROUP BY date_trunc('hour', to_timestamp(bh.timestamp))
-        """
-
-    df = (pd.read_sql(QUERY, connection)
+def network_RB_power_distribution(source):
+    df = (source.hourly_rollup('network_RB_power_distribution')
             .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
 
-    fig_df = df.melt(id_vars=['time'])
-    fig = px.line(fig_df,
-                  x='time',
-                  y='value',
-                  color='variable',
-                  title='RB Power distribution',
-                  labels={'value': 'Bytes',
-                          'time': 'Timestamp',
-                          'variable': 'Metric'})
+    fig = compact_line(df,
+                       x='time',
+                       title='RB Power distribution',
+                       labels={'value': 'Bytes',
+                               'time': 'Timestamp',
+                               'variable': 'Metric'},
+                       epoch='epoch')
     return fig
 
 
-def relative_qa_power_distribution(connection):
-    QUERY = """
-        SELECT 
-        AVG(total_qa_bytes_committed::numeric / total_qa_bytes_power::numeric) as total_committed,
-        AVG(qa_smoothed_position_estimate::numeric * 2^(-128) / total_qa_bytes_power::numeric) AS position_estimate,
-        MIN(bh.timestamp) AS time
-        FROM chain_powers cp
-        LEFT JOIN block_headers bh
-        ON bh.parent_state_root = cp.state_root
-        GROUP BY date_trunc('hour',  to_timestamp(bh.timestamp))
-            """
-
-    df = (pd.read_sql(QUERY, connection)
+def relative_qa_power_distribution(source):
+    df = (source.hourly_rollup('relative_qa_power_distribution')
             .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
 
-    fig_df = df.melt(id_vars=['time'])
-    fig = px.line(fig_df,
-                  x='time',
-                  y='value',
-                  color='variable',
-                  title='QA Power distribution rel. to the realized power)',
-                  labels={'value': '/% QA Power',
-                          'time': 'Timestamp',
-                          'variable': 'Metric'})
+    fig = compact_line(df,
+                       x='time',
+                       title='QA Power distribution rel. to the realized power)',
+                       labels={'value': '/% QA Power',
+                               'time': 'Timestamp',
+                               'variable': 'Metric'},
+                       epoch='epoch')
     return fig
 
 
-def qa_power_velocity_estimate(connection):
-    QUERY = """
-        SELECT 
-        AVG(cp.qa_smoothed_velocity_estimate::numeric * 2^(-128) * 2^(-50)) AS velocity_estimate,
-        MIN(bh.timestamp) AS time
-        FROM chain_powers cp
-        LEFT JOIN block_headers bh
-        ON bh.parent_state_root = cp.state_root
-        GROUP BY date_trunc('hour',  to_timestamp(bh.timestamp))
-            """
-
-    df = (pd.read_sql(QUERY, connection)
+def qa_power_velocity_estimate(source):
+    df = (source.hourly_rollup('qa_power_velocity_estimate')
             .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
 
-    fig_df = df.melt(id_vars=['time'])
-    fig = px.line(fig_df,
-                  x='time',
-                  y='value',
-                  color='variable',
-                  title='QA Power Velocity Estimate',
-                  labels={'value': 'Filwatts / Epoch',
-                          'time': 'Timestamp',
-                          'variable': 'Metric'})
+    fig = compact_line(df,
+                       x='time',
+                       title='QA Power Velocity Estimate',
+                       labels={'value': 'Filwatts / Epoch',
+                               'time': 'Timestamp',
+                               'variable': 'Metric'},
+                       epoch='epoch')
     return fig
 
 
-def per_epoch_reward_actual(connection):
-
-    QUERY = """
-       SELECT
-        AVG((cr.new_reward::numeric * 1e-18)) as Per_Epoch_Reward_Actual,
-        MIN(bh.timestamp) AS time
-        FROM chain_rewards cr
-        LEFT JOIN block_headers bh
-        ON bh.parent_state_root = cr.state_root
-        GROUP BY date_trunc('hour', to_timestamp(bh.timestamp))
-        ORDER BY time ASC
-        """
-    df = (pd.read_sql(QUERY, connection)
+def per_epoch_reward_actual(source):
+    df = (source.hourly_rollup('per_epoch_reward_actual')
           .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
 
-    fig_df = df.melt(id_vars=['time'])
-    fig = px.line(fig_df,
-                  x='time',
-                  y='value',
-                  color='variable',
-                  title='Per Epoch Reward Actual',
-                  labels={'value': 'FIL',
-                          'time': 'Timestamp',
-                          'variable': 'Metric'})
+    fig = compact_line(df,
+                       x='time',
+                       title='Per Epoch Reward Actual',
+                       labels={'value': 'FIL',
+                               'time': 'Timestamp',
+                               'variable': 'Metric'},
+                       epoch='epoch')
     return fig
 
 
-def per_epoch_reward_estimate(connection):
-
-    QUERY = """
-        SELECT
-        avg((cr.new_reward_smoothed_position_estimate::numeric * 2^(-128) * 1e-18)) as Per_Epoch_Reward_Position_Estimate,
-        min(bh.timestamp) AS time
-        FROM chain_rewards cr
-        LEFT JOIN block_headers bh
-        ON bh.parent_state_root = cr.state_root
-        GROUP BY date_trunc('hour', to_timestamp(bh.timestamp))
-        ORDER BY time ASC
-        """
-    df = (pd.read_sql(QUERY, connection)
+def per_epoch_reward_estimate(source):
+    df = (source.hourly_rollup('per_epoch_reward_estimate')
           .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
 
-    fig_df = df.melt(id_vars=['time'])
-    fig = px.line(fig_df,
-                  x='time',
-                  y='value',
-                  color='variable',
-                  title='Per Epoch Reward Position Estimate',
-                  labels={'value': 'FIL',
-                          'time': 'Timestamp',
-                          'variable': 'Metric'})
+    fig = compact_line(df,
+                       x='time',
+                       title='Per Epoch Reward Position Estimate',
+                       labels={'value': 'FIL',
+                               'time': 'Timestamp',
+                               'variable': 'Metric'},
+                       epoch='epoch')
     return fig
 
 
-def per_epoch_reward_velocity_estimate(connection):
-    QUERY = """
-        SELECT
-        avg((cr.new_reward_smoothed_velocity_estimate::numeric * 2^(-128) * 1e-18)) as Per_Epoch_Reward_Velocity_Estimate,
-        min(bh.timestamp) AS time
-        FROM chain_rewards cr
-        LEFT JOIN block_headers bh
-        ON bh.parent_state_root = cr.state_root
-        GROUP BY date_trunc('hour', to_timestamp(bh.timestamp))
-        ORDER BY time ASC
-        """
-    df = (pd.read_sql(QUERY, connection)
+def per_epoch_reward_velocity_estimate(source):
+    df = (source.hourly_rollup('per_epoch_reward_velocity_estimate')
           .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
 
-    fig_df = df.melt(id_vars=['time'])
-    fig = px.line(fig_df,
-                  x='time',
-                  y='value',
-                  color='variable',
-                  title='Per Epoch Reward Velocity Estimate',
-                  labels={'value': 'FIL / epoch',
-                          'time': 'Timestamp',
-                          'variable': 'Metric'})
+    fig = compact_line(df,
+                       x='time',
+                       title='Per Epoch Reward Velocity Estimate',
+                       labels={'value': 'FIL / epoch',
+                               'time': 'Timestamp',
+                               'variable': 'Metric'},
+                       epoch='epoch')
     return fig
 
 # TODO
 
 
-def upcoming_sector_expiration_by_epoch(connection):
+def upcoming_sector_expiration_by_epoch(source):
     QUERY = """
         SELECT 
         COUNT(info.expiration_epoch) AS Upcoming_Sector_Expiration,
@@ -418,24 +344,24 @@ def upcoming_sector_expiration_by_epoch(connection):
         to_timestamp(info.expiration_epoch) > Now()
         GROUP BY date_trunc('hour',  to_timestamp(bh.timestamp))
         """
-    df = (pd.read_sql(QUERY, connection)
+    df = (source.read_sql(QUERY)
           .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
 
     fig_df = df
     if len(fig_df) > 0:
-        fig = px.line(fig_df,
-                      x='time',
-                      y='Upcoming_Sector_Expiration',
-                      title='Upcoming Sector Expiration',
-                      labels={'value': 'Sectors',
-                              'time': 'Timestamp'})
+        fig = compact_line(fig_df,
+                           x='time',
+                           y='Upcoming_Sector_Expiration',
+                           title='Upcoming Sector Expiration',
+                           labels={'value': 'Sectors',
+                                   'time': 'Timestamp'})
     else:
         fig = None
     return fig
 
 
-def number_of_deals_made(connection):
+def number_of_deals_made(source):
     QUERY = """
         SELECT 
         COUNT(deal_id) as number_of_deals_made,
@@ -447,20 +373,20 @@ def number_of_deals_made(connection):
         info.last_update_epoch > 0
         GROUP BY date_trunc('day',  to_timestamp(bh.timestamp))
         """
-    df = (pd.read_sql(QUERY, connection).sort_values('date'))
+    df = (source.read_sql(QUERY).sort_values('date'))
 
     df['number_of_deals_made_cumulated'] = df.number_of_deals_made.cumsum()
 
-    fig = px.line(df,
-                  x='date',
-                  y=['number_of_deals_made', 'number_of_deals_made_cumulated'],
-                  title='Number of Deals Made',
-                  labels={'value': 'Number of Deals',
-                          'date': 'Timestamp'})
+    fig = compact_line(df,
+                       x='date',
+                       y=['number_of_deals_made', 'number_of_deals_made_cumulated'],
+                       title='Number of Deals Made',
+                       labels={'value': 'Number of Deals',
+                               'date': 'Timestamp'})
     return fig
 
 
-def number_of_terminated_deals(connection):
+def number_of_terminated_deals(source):
     QUERY = """
         SELECT 
         COUNT(deal_id) as number_of_terminated_deals,
@@ -472,24 +398,24 @@ def number_of_terminated_deals(connection):
         info.slash_epoch > 0
         GROUP BY date_trunc('day',  to_timestamp(bh.timestamp))
         """
-    df = (pd.read_sql(QUERY, connection).sort_values('date'))
+    df = (source.read_sql(QUERY).sort_values('date'))
 
     df['number_of_terminated_deals_cumulated'] = df.number_of_terminated_deals.cumsum()
 
     if len(df) > 0:
-        fig = px.line(df,
-                      x='date',
-                      y=['number_of_terminated_deals',
-                          'number_of_terminated_deals_cumulated'],
-                      title='Number of Terminated Deals',
-                      labels={'value': 'Number of Terminated Deals',
-                              'date': 'Timestamp'})
+        fig = compact_line(df,
+                           x='date',
+                           y=['number_of_terminated_deals',
+                               'number_of_terminated_deals_cumulated'],
+                           title='Number of Terminated Deals',
+                           labels={'value': 'Number of Terminated Deals',
+                                   'date': 'Timestamp'})
     else:
         fig = None
     return fig
 
 
-def verified_client_deals_proportion(connection):
+def verified_client_deals_proportion(source):
     QUERY = """
         SELECT
         COUNT(mdp.is_verified) filter (where mdp.is_verified::BOOLEAN) / COUNT(mdp.deal_id) AS verified_fraction,
@@ -499,18 +425,18 @@ def verified_client_deals_proportion(connection):
         ON bh.parent_state_root = mdp.state_root
         GROUP BY date_trunc('hour',  to_timestamp(bh.timestamp))
         """
-    df = (pd.read_sql(QUERY, connection))
+    df = (source.read_sql(QUERY))
 
     if len(df) == 0:
         return None
     else:
-        fig = px.line(df,
-                      x='time',
-                      y='verified_fraction',
-                      title='Fraction of Verified Deals')
+        fig = compact_line(df,
+                           x='time',
+                           y='verified_fraction',
+                           title='Fraction of Verified Deals')
         return fig
 
-def initial_storage_pledge_per_32gib(connection):
+def initial_storage_pledge_per_32gib(source):
     QUERY = """
         WITH estimate AS (
                 SELECT
@@ -530,7 +456,7 @@ def initial_storage_pledge_per_32gib(connection):
         ON bh.parent_state_root = est.state_root
         GROUP BY date_trunc('hour', to_timestamp(bh.timestamp))
         """
-    df = (pd.read_sql(QUERY, connection)
+    df = (source.read_sql(QUERY)
           .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
     VIZ_PARAMS = {'title': 'Initial Storage Pledge per 32 GiB of QA power',
@@ -539,7 +465,7 @@ def initial_storage_pledge_per_32gib(connection):
     return fig
 
 
-def projection_of_the_fault_fee_per_unit_of_qa_power(connection):
+def projection_of_the_fault_fee_per_unit_of_qa_power(source):
     QUERY = """
         WITH estimate AS (
                 SELECT
@@ -559,7 +485,7 @@ def projection_of_the_fault_fee_per_unit_of_qa_power(connection):
         ON bh.parent_state_root = est.state_root
         GROUP BY date_trunc('hour', to_timestamp(bh.timestamp))
         """
-    df = (pd.read_sql(QUERY, connection)
+    df = (source.read_sql(QUERY)
           .assign(time=lambda df: pd.to_datetime(df.time, unit='s'))
           )
     VIZ_PARAMS = {'title': 'Fault Fee per unit of QA power',
@@ -575,11 +501,11 @@ def time_measure(f):
     return out
 
 
-def time_measure_with_conn(f, connection):
+def time_measure_with_source(f, source):
     t1 = time()
-    out = f(connection)
+    out = f(source)
     t2 = time()
-    print(f"{f.__name__} execution time: {t2 - t1 :.1f}s")
+    print(f"[{source.name}] {f.__name__} execution time: {t2 - t1 :.1f}s")
     return out
 
 # %%
@@ -605,9 +531,40 @@ FIGURES_FUNCTIONS = [
     projection_of_the_fault_fee_per_unit_of_qa_power
 ]
 
-connection = create_engine(conn_string, pool_recycle=3600).connect()
-
-# Visualizations to be show on the Dash App, order-sensitive.
-FIGURES = [time_measure_with_conn(f, connection) for f in FIGURES_FUNCTIONS]
+SOURCES = load_sources()
+
+# Alert state is kept per source, as the same metric differs between networks
+ALERT_ENGINES = {name: AlertEngine(default_rules(), ALERT_SINKS, source=name,
+                                   state_path=source.alerts_path)
+                 for name, source in SOURCES.items()}
+
+
+def refresh_figures(source):
+    figures = SeriesStore()
+    for f in FIGURES_FUNCTIONS:
+        fig = time_measure_with_source(f, source)
+        if fig is not None:
+            ALERT_ENGINES[source.name].observe_figure(f.__name__, fig)
+        figures.add(f.__name__, fig)
+    # ru_maxrss is in KiB on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
+    print(f"[{source.name}] Series store size: {figures.nbytes() / 2 ** 20 :.1f} MiB, "
+          f"worker max RSS: {max_rss :.1f} MiB")
+    return figures
+
+
+def first_refresh(source):
+    # An unreachable source must not take the others down with it
+    try:
+        return refresh_figures(source)
+    except Exception as e:
+        print(f"[{source.name}] Figures refresh failed: {e}")
+        return []
+
+
+# Visualizations to be show on the Dash App by source, order-sensitive.
+# Sources are refreshed in parallel, so startup doesn't grow with their number.
+with ThreadPoolExecutor(max_workers=len(SOURCES)) as executor:
+    FIGURES = dict(zip(SOURCES, executor.map(first_refresh, SOURCES.values())))
 
 # %%
@@ -3,7 +3,11 @@ import dash
 import dash_auth
 import dash_core_components as dcc
 import dash_html_components as html
-from figures import FIGURES
+import figures
+from dash.dependencies import Input, Output
+from flask import jsonify, request
+from threading import Thread
+from time import sleep
 
 # Dash parameters
 VALID_USERNAME_PASSWORD_PAIRS = {
@@ -21,11 +25,51 @@ auth = dash_auth.BasicAuth(
     VALID_USERNAME_PASSWORD_PAIRS
 )
 
-# Create a image for each key-value on figures.py
-app.layout = html.Div(children=[
-    html.Img(src="assets/fil-health-monitor.png"),
-    *(dcc.Graph(figure=fig) for fig in FIGURES if fig is not None)
-])
+# Source selector, and a image for each key-value on figures.py
+def serve_layout():
+    sources = list(figures.SOURCES)
+    return html.Div(children=[
+        html.Img(src="assets/fil-health-monitor.png"),
+        dcc.Dropdown(id='source',
+                     options=[{'label': name, 'value': name} for name in sources],
+                     value=sources[0],
+                     clearable=False),
+        html.Div(id='figures')
+    ])
+
+
+app.layout = serve_layout
+
+
+@app.callback(Output('figures', 'children'), [Input('source', 'value')])
+def show_figures(source):
+    return [dcc.Graph(figure=fig.figure())
+            for fig in figures.FIGURES.get(source, []) if fig is not None]
+
+
+# Firing alerts as JSON, optionally for a single source
+@server.route('/alerts')
+def alerts():
+    source = request.args.get('source')
+    engines = figures.ALERT_ENGINES
+    if source is not None:
+        engines = {source: engines[source]} if source in engines else {}
+    return jsonify([alert for engine in engines.values()
+                    for alert in engine.firing_alerts()])
+
+
+# Each source is refreshed on its own schedule
+def refresh_loop(source):
+    while True:
+        sleep(source.refresh_interval)
+        try:
+            figures.FIGURES[source.name] = figures.refresh_figures(source)
+        except Exception as e:
+            print(f"[{source.name}] Figures refresh failed: {e}")
+
+
+for source in figures.SOURCES.values():
+    Thread(target=refresh_loop, args=(source,), daemon=True).start()
 
 # Run Dash
 if __name__ == '__main__':
@@ -4,6 +4,7 @@
 # Notebook for performing quick queries
 
 # %%
+import sys
 from sqlalchemy import create_engine
 import pandas as pd
 import plotly.express as px
@@ -12,6 +13,9 @@ import json
 from IPython import get_ipython
 get_ipython().run_line_magic('load_ext', 'autotime')
 
+sys.path.append('..')
+from query_cache import cached_query
+
 
 # %%
 
@@ -19,11 +23,14 @@ pd.options.plotting.backend = "plotly"
 
 CONN_STRING_PATH = '../config/sentinel-conn-string.txt'
 
+QUERY_CACHE_DIR = '../data/mainnet/query-cache'
+
 with open(CONN_STRING_PATH, 'r') as fid:
     conn_string = fid.read()
 
-# %%
 connection = create_engine(conn_string, pool_recycle=3600).connect()
+
+# %%
 QUERY = """
         SELECT
         COUNT(mdp.is_verified) filter (where mdp.is_verified::BOOLEAN) / COUNT(mdp.deal_id) AS verified_fraction,
@@ -34,13 +41,12 @@ QUERY = """
         GROUP BY date_trunc('hour',  to_timestamp(bh.timestamp))
         """
 
-df = (pd.read_sql(QUERY, connection)
+df = (cached_query(connection, QUERY, cache_dir=QUERY_CACHE_DIR)
       )
 
 print(df.head(10))
 
 # %%
-connection = create_engine(conn_string, pool_recycle=3600).connect()
 QUERY = """
         SELECT 
         COUNT(deal_id) as Number_of_deals_made,
@@ -53,7 +59,7 @@ QUERY = """
         GROUP BY date_trunc('hour',  to_timestamp(bh.timestamp))
         """
 
-df = (pd.read_sql(QUERY, connection)
+df = (cached_query(connection, QUERY, cache_dir=QUERY_CACHE_DIR)
       )
 
 print(df.shape)
@@ -61,7 +67,6 @@ print(df.shape)
 px.box(df, x='time', y='projection')
 
 # %%
-connection = create_engine(conn_string, pool_recycle=3600).connect()
 QUERY = """
         SELECT 
         COUNT(deal_id) as number_of_deals_made,
@@ -74,7 +79,7 @@ QUERY = """
         GROUP BY date_trunc('day',  to_timestamp(bh.timestamp))
         """
 
-df = (pd.read_sql(QUERY, connection)
+df = (cached_query(connection, QUERY, cache_dir=QUERY_CACHE_DIR)
       )
 
 print(df.shape)
@@ -83,7 +88,6 @@ px.line(df,
         y='number_of_deals_made')
 
 # %%
-connection = create_engine(conn_string, pool_recycle=3600).connect()
 QUERY = """
         SELECT
         cr.new_reward_smoothed_position_estimate::float as position,
@@ -96,6 +100,6 @@ QUERY = """
         ON cp.state_root = bh.parent_state_root
         """
 
-df = (pd.read_sql(QUERY, connection)
+df = (cached_query(connection, QUERY, cache_dir=QUERY_CACHE_DIR)
       )
 # %%
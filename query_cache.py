@@ -0,0 +1,112 @@
+# Dependences
+import hashlib
+import json
+import os
+import re
+from decimal import Decimal
+from glob import glob
+from time import time
+import pandas as pd
+from sqlalchemy import text
+
+# Parquet files, one per query and chain head
+QUERY_CACHE_DIR = 'data/query-cache'
+QUERY_CACHE_MAX_BYTES = 2 * 1024 ** 3
+QUERY_CACHE_MAX_ENTRIES = 512
+
+# Seconds during which the chain head is reused instead of queried (one epoch)
+HEAD_TTL = 30
+
+_heads = {}
+
+
+def normalize_sql(query: str) -> str:
+    query = re.sub(r'--[^\n]*', '', query)
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+def fingerprint(query: str, params: dict = None) -> str:
+    key = json.dumps([normalize_sql(query), params or {}], sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def chain_head(connection, cache_dir: str = QUERY_CACHE_DIR) -> int:
+    # Each source has its own cache directory, so heads are memoized by it
+    cached = _heads.get(cache_dir)
+    if cached is not None and time() - cached[1] < HEAD_TTL:
+        return cached[0]
+    head = connection.execute(text("SELECT MAX(height) FROM block_headers")).scalar()
+    _heads[cache_dir] = (head, time())
+    return head
+
+
+def _remove(path: str):
+    # Other workers may be sharing the same cache directory
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def decimals_to_float(df: pd.DataFrame) -> pd.DataFrame:
+    # NUMERIC columns come as Decimal objects, which Parquet can't always hold
+    for col in df.columns:
+        values = df[col].dropna()
+        if df[col].dtype == object and len(values) > 0 and isinstance(values.iloc[0], Decimal):
+            df[col] = df[col].astype(float)
+    return df
+
+
+def _evict(cache_dir: str, max_bytes: int, max_entries: int):
+    # Least recently used first, as hits touch the file
+    entries = []
+    for f in glob(os.path.join(cache_dir, '*.parquet')):
+        try:
+            stat = os.stat(f)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, f))
+    entries.sort()
+
+    total = sum(size for _, size, _ in entries)
+    count = len(entries)
+    for _, size, f in entries:
+        if total <= max_bytes and count <= max_entries:
+            break
+        _remove(f)
+        total -= size
+        count -= 1
+
+
+def cached_query(connection, query: str, params: dict = None,
+                 cache_dir: str = QUERY_CACHE_DIR,
+                 head_bucket: int = 1,
+                 max_bytes: int = QUERY_CACHE_MAX_BYTES,
+                 max_entries: int = QUERY_CACHE_MAX_ENTRIES) -> pd.DataFrame:
+    """
+    `pd.read_sql` cached on disk by the normalized SQL, its parameters and
+    the current chain head, so that a result is only recomputed once the
+    chain has advanced. The head is rounded down to `head_bucket` epochs,
+    eg. 120 reuses results for up to an hour of new epochs.
+    """
+    fp = fingerprint(query, params)
+    head = chain_head(connection, cache_dir)
+    head -= head % head_bucket
+    path = os.path.join(cache_dir, f"{fp}-{head}.parquet")
+
+    try:
+        os.utime(path)
+        return pd.read_parquet(path)
+    except FileNotFoundError:
+        pass
+
+    df = decimals_to_float(pd.read_sql(text(query), connection, params=params))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale in glob(os.path.join(cache_dir, f"{fp}-*.parquet")):
+        _remove(stale)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    _evict(cache_dir, max_bytes, max_entries)
+    return df
@@ -0,0 +1,200 @@
+# Dependences
+import os
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+from query_cache import cached_query, decimals_to_float, QUERY_CACHE_DIR
+
+# Hourly aggregates are bucketed by epoch (30s each) instead of by wall-clock
+# hour, so that epoch-range partitions never split a bucket.
+EPOCHS_PER_HOUR = 120
+MAX_EPOCH = 2 ** 62
+
+# Local store with the aggregates already computed by `backfill.py`
+ROLLUP_STORE_PATH = 'data/rollups.sqlite'
+
+# Hourly queries on the epoch range [:start, :end), by metric.
+ROLLUP_QUERIES = {
+    'network_RB_power_distribution': """
+        SELECT
+        avg(total_raw_bytes_power::numeric) * 2^(-50) AS total_power,
+        avg(total_raw_bytes_committed::numeric) * 2^(-50) AS total_committed,
+        min(bh.timestamp) AS time,
+        min(bh.height) / 120 * 120 AS epoch
+        FROM chain_powers cp
+        LEFT JOIN block_headers bh
+        ON bh.parent_state_root = cp.state_root
+        WHERE bh.height >= :start AND bh.height < :end
+        GROUP BY bh.height / 120
+        ORDER BY epoch
+        """,
+    'absolute_qa_power_distribution': """
+        SELECT
+        AVG(total_qa_bytes_power::numeric) * 2^(-50) AS total_power,
+        AVG(total_qa_bytes_committed::numeric) * 2^(-50) as total_committed,
+        AVG(qa_smoothed_position_estimate::numeric) * 2^(-128) * 2^(-50) AS position_estimate,
+        MIN(bh.timestamp) AS time,
+        MIN(bh.height) / 120 * 120 AS epoch
+        FROM chain_powers cp
+        LEFT JOIN block_headers bh
+        ON bh.parent_state_root = cp.state_root
+        WHERE bh.height >= :start AND bh.height < :end
+        GROUP BY bh.height / 120
+        ORDER BY epoch
+        """,
+    'relative_qa_power_distribution': """
+        SELECT
+        AVG(total_qa_bytes_committed::numeric / total_qa_bytes_power::numeric) as total_committed,
+        AVG(qa_smoothed_position_estimate::numeric * 2^(-128) / total_qa_bytes_power::numeric) AS position_estimate,
+        MIN(bh.timestamp) AS time,
+        MIN(bh.height) / 120 * 120 AS epoch
+        FROM chain_powers cp
+        LEFT JOIN block_headers bh
+        ON bh.parent_state_root = cp.state_root
+        WHERE bh.height >= :start AND bh.height < :end
+        GROUP BY bh.height / 120
+        ORDER BY epoch
+        """,
+    'qa_power_velocity_estimate': """
+        SELECT
+        AVG(cp.qa_smoothed_velocity_estimate::numeric * 2^(-128) * 2^(-50)) AS velocity_estimate,
+        MIN(bh.timestamp) AS time,
+        MIN(bh.height) / 120 * 120 AS epoch
+        FROM chain_powers cp
+        LEFT JOIN block_headers bh
+        ON bh.parent_state_root = cp.state_root
+        WHERE bh.height >= :start AND bh.height < :end
+        GROUP BY bh.height / 120
+        ORDER BY epoch
+        """,
+    'per_epoch_reward_actual': """
+        SELECT
+        AVG((cr.new_reward::numeric * 1e-18)) as Per_Epoch_Reward_Actual,
+        MIN(bh.timestamp) AS time,
+        MIN(bh.height) / 120 * 120 AS epoch
+        FROM chain_rewards cr
+        LEFT JOIN block_headers bh
+        ON bh.parent_state_root = cr.state_root
+        WHERE bh.height >= :start AND bh.height < :end
+        GROUP BY bh.height / 120
+        ORDER BY epoch
+        """,
+    'per_epoch_reward_estimate': """
+        SELECT
+        avg((cr.new_reward_smoothed_position_estimate::numeric * 2^(-128) * 1e-18)) as Per_Epoch_Reward_Position_Estimate,
+        min(bh.timestamp) AS time,
+        min(bh.height) / 120 * 120 AS epoch
+        FROM chain_rewards cr
+        LEFT JOIN block_headers bh
+        ON bh.parent_state_root = cr.state_root
+        WHERE bh.height >= :start AND bh.height < :end
+        GROUP BY bh.height / 120
+        ORDER BY epoch
+        """,
+    'per_epoch_reward_velocity_estimate': """
+        SELECT
+        avg((cr.new_reward_smoothed_velocity_estimate::numeric * 2^(-128) * 1e-18)) as Per_Epoch_Reward_Velocity_Estimate,
+        min(bh.timestamp) AS time,
+        min(bh.height) / 120 * 120 AS epoch
+        FROM chain_rewards cr
+        LEFT JOIN block_headers bh
+        ON bh.parent_state_root = cr.state_root
+        WHERE bh.height >= :start AND bh.height < :end
+        GROUP BY bh.height / 120
+        ORDER BY epoch
+        """,
+}
+
+CHECKPOINTS_DDL = """
+    CREATE TABLE IF NOT EXISTS backfill_checkpoints (
+        metric TEXT NOT NULL,
+        start_epoch INTEGER NOT NULL,
+        end_epoch INTEGER NOT NULL,
+        rows INTEGER NOT NULL,
+        seconds REAL NOT NULL,
+        PRIMARY KEY (metric, start_epoch)
+    )
+    """
+
+
+def query_partition(connection, metric: str, start: int, end: int) -> pd.DataFrame:
+    df = pd.read_sql(text(ROLLUP_QUERIES[metric]), connection,
+                     params={'start': start, 'end': end})
+    # SQLite can't bind the Decimal objects of NUMERIC columns
+    return decimals_to_float(df)
+
+
+def store_engine(path: str = ROLLUP_STORE_PATH):
+    """
+    Engine of the rollup store, with its checkpoints table, for `backfill.py`.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text(CHECKPOINTS_DDL))
+    return engine
+
+
+def completed_partitions(store, metric: str) -> list:
+    QUERY = """
+        SELECT start_epoch, end_epoch
+        FROM backfill_checkpoints
+        WHERE metric = :metric
+        ORDER BY start_epoch
+        """
+    with store.connect() as conn:
+        return [tuple(row) for row in conn.execute(text(QUERY), {'metric': metric})]
+
+
+def store_partition(store, metric: str, start: int, end: int,
+                    df: pd.DataFrame, seconds: float):
+    """
+    Writes the rows of a partition and its checkpoint in one transaction,
+    so a partition is either fully stored or retried on resume. Rows
+    already stored for the range are replaced, as the last partition of a
+    previous run can be extended by a later one.
+    """
+    with store.begin() as conn:
+        if inspect(conn).has_table(metric):
+            conn.execute(text(f"DELETE FROM {metric} WHERE epoch >= :start AND epoch < :end"),
+                         {'start': start, 'end': end})
+        if len(df) > 0:
+            df.to_sql(metric, conn, if_exists='append', index=False)
+        conn.execute(text("""
+            INSERT OR REPLACE INTO backfill_checkpoints
+            VALUES (:metric, :start, :end, :rows, :seconds)
+            """),
+            {'metric': metric, 'start': start, 'end': end,
+             'rows': len(df), 'seconds': seconds})
+
+
+def high_water_mark(store, metric: str) -> int:
+    """
+    End of the contiguous range of completed partitions starting at genesis.
+    """
+    hwm = 0
+    for start, end in completed_partitions(store, metric):
+        if start > hwm:
+            break
+        hwm = max(hwm, end)
+    return hwm
+
+
+def hourly_rollup(connection, metric: str, store=None,
+                  cache_dir: str = QUERY_CACHE_DIR,
+                  head_bucket: int = EPOCHS_PER_HOUR) -> pd.DataFrame:
+    """
+    Stored aggregates up to the high-water mark, plus the epochs after it
+    queried from Sentinel. `store` is the engine of the rollup store, or
+    None when nothing was backfilled.
+    """
+    hwm = 0
+    stored = None
+    if store is not None and inspect(store).has_table('backfill_checkpoints'):
+        hwm = high_water_mark(store, metric)
+        if hwm > 0 and inspect(store).has_table(metric):
+            stored = pd.read_sql(text(f"SELECT * FROM {metric} WHERE epoch < :hwm ORDER BY epoch"),
+                                 store, params={'hwm': hwm})
+    tail = cached_query(connection, ROLLUP_QUERIES[metric],
+                        params={'start': hwm, 'end': MAX_EPOCH},
+                        cache_dir=cache_dir, head_bucket=head_bucket)
+    return pd.concat([stored, tail], ignore_index=True)
@@ -0,0 +1,127 @@
+# Dependences
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+
+class CompactFigure():
+    """
+    Line chart data held as one int64 x axis (plus an optional int64 epoch
+    axis) shared by all the series, and a float64 row of values per series.
+    The Plotly figure is only built when `figure` is called.
+    """
+    __slots__ = ('title', 'x_title', 'y_title', 'legend_title', 'log_y',
+                 'x', 'x_is_datetime', 'epoch', 'names', 'values')
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def x_values(self) -> np.ndarray:
+        return self.x.view('datetime64[ns]') if self.x_is_datetime else self.x
+
+    def series(self):
+        x = self.x_values
+        for name, values in zip(self.names, self.values):
+            yield name, x, values
+
+    def arrays(self) -> list:
+        arrays = [self.x, self.values]
+        if self.epoch is not None:
+            arrays.append(self.epoch)
+        return arrays
+
+    def figure(self) -> go.Figure:
+        show_legend = len(self.names) > 1
+        fig = go.Figure([go.Scatter(x=x, y=values, name=name, mode='lines',
+                                    showlegend=show_legend)
+                         for name, x, values in self.series()])
+        fig.update_layout(title=self.title,
+                          xaxis_title=self.x_title,
+                          yaxis_title=self.y_title,
+                          legend_title=self.legend_title)
+        if self.log_y:
+            fig.update_yaxes(type='log')
+        return fig
+
+
+def _int64_axis(col: pd.Series) -> tuple:
+    if isinstance(col.dtype, pd.DatetimeTZDtype):
+        col = col.dt.tz_convert(None)
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col.to_numpy(dtype='datetime64[ns]').view('int64'), True
+    return col.to_numpy(dtype='int64'), False
+
+
+def compact_line(df: pd.DataFrame, x: str, y=None, title: str = None,
+                 labels: dict = None, log_y: bool = False,
+                 epoch: str = None) -> CompactFigure:
+    """
+    Takes the same wide frame and arguments as `px.line`. When `y` is not
+    given, every column other than `x` and `epoch` is a series, which
+    replaces the `df.melt(...)` + `color='variable'` pattern.
+    """
+    labels = labels or {}
+    # Points without an x can't be drawn
+    df = df[df[x].notna()]
+    melted = y is None
+    if melted:
+        y = [col for col in df.columns if col not in (x, epoch)]
+    elif isinstance(y, str):
+        y = [y]
+
+    fig = CompactFigure()
+    fig.title = title
+    fig.x_title = labels.get(x, x)
+    if melted or len(y) > 1:
+        fig.y_title = labels.get('value', 'value')
+    else:
+        fig.y_title = labels.get(y[0], y[0])
+    fig.legend_title = labels.get('variable', 'variable')
+    fig.log_y = log_y
+    fig.x, fig.x_is_datetime = _int64_axis(df[x])
+    fig.epoch = df[epoch].to_numpy(dtype='int64') if epoch is not None else None
+    fig.names = tuple(y)
+    fig.values = np.ascontiguousarray(df[y].to_numpy(dtype='float64').T)
+    return fig
+
+
+class SeriesStore():
+    """
+    The figures of the dashboard, in order. Equal axes are stored once and
+    shared between figures, eg. the hourly rollups of the same table.
+    """
+    __slots__ = ('names', 'figures', '_axes')
+
+    def __init__(self):
+        self.names = []
+        self.figures = []
+        self._axes = {}
+
+    def __iter__(self):
+        return iter(self.figures)
+
+    def __len__(self):
+        return len(self.figures)
+
+    def _intern(self, axis: np.ndarray) -> np.ndarray:
+        if axis is None:
+            return None
+        key = (len(axis), hash(axis.tobytes()))
+        shared = self._axes.get(key)
+        if shared is not None and np.array_equal(shared, axis):
+            return shared
+        self._axes[key] = axis
+        return axis
+
+    def add(self, name: str, fig: CompactFigure):
+        if fig is not None:
+            fig.x = self._intern(fig.x)
+            fig.epoch = self._intern(fig.epoch)
+        self.names.append(name)
+        self.figures.append(fig)
+
+    def nbytes(self) -> int:
+        arrays = {id(a): a for fig in self.figures if fig is not None
+                  for a in fig.arrays()}
+        return sum(a.nbytes for a in arrays.values())
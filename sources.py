@@ -0,0 +1,78 @@
+# Dependences
+import json
+import os
+from sqlalchemy import create_engine
+import rollups
+from query_cache import cached_query
+
+# Single Sentinel instance, used when there is no sources file
+CONN_STRING_PATH = 'config/sentinel-conn-string.txt'
+DEFAULT_SOURCE = 'mainnet'
+
+# Several Sentinel instances, eg.
+# {"mainnet": {"conn_string": "postgres://..."},
+#  "calibnet": {"conn_string": "postgres://...", "refresh_interval": 1800}}
+SOURCES_PATH = 'config/sources.json'
+
+# Seconds between re-running the figure queries and evaluating the alerts
+REFRESH_INTERVAL = 3600
+
+EPOCH_SECONDS = 30
+
+
+class Source():
+    """
+    A Sentinel instance, with its own connection pool, query cache and
+    rollup store.
+    """
+
+    def __init__(self, name: str, conn_string: str, refresh_interval: float = REFRESH_INTERVAL):
+        self.name = name
+        self.conn_string = conn_string
+        self.refresh_interval = refresh_interval
+        self.cache_dir = os.path.join('data', name, 'query-cache')
+        self.rollup_path = os.path.join('data', name, 'rollups.sqlite')
+        self.alerts_path = os.path.join('data', name, 'alerts.json')
+        self._engine = None
+        self._store = None
+
+    @property
+    def engine(self):
+        # Created on first use, so that forked processes don't share the pool
+        if self._engine is None:
+            self._engine = create_engine(self.conn_string, pool_recycle=3600)
+        return self._engine
+
+    @property
+    def store(self):
+        # Rollup store written by `backfill.py`, None until it exists
+        if self._store is None and os.path.exists(self.rollup_path):
+            self._store = create_engine(f"sqlite:///{self.rollup_path}")
+        return self._store
+
+    @property
+    def head_bucket(self) -> int:
+        # Cached results are reused for as many epochs as pass between refreshes
+        return max(1, int(self.refresh_interval // EPOCH_SECONDS))
+
+    def read_sql(self, query: str, params: dict = None):
+        with self.engine.connect() as connection:
+            return cached_query(connection, query, params, cache_dir=self.cache_dir,
+                                head_bucket=self.head_bucket)
+
+    def hourly_rollup(self, metric: str):
+        with self.engine.connect() as connection:
+            return rollups.hourly_rollup(connection, metric, self.store,
+                                         cache_dir=self.cache_dir,
+                                         head_bucket=self.head_bucket)
+
+
+def load_sources() -> dict:
+    if os.path.exists(SOURCES_PATH):
+        with open(SOURCES_PATH, 'r') as fid:
+            config = json.load(fid)
+        return {name: Source(name, **params) for name, params in config.items()}
+
+    with open(CONN_STRING_PATH, 'r') as fid:
+        conn_string = fid.read()
+    return {DEFAULT_SOURCE: Source(DEFAULT_SOURCE, conn_string)}
@@ -0,0 +1,108 @@
+import statistics
+
+import numpy as np
+import pytest
+
+from alerts import (AlertEngine, LocalSink, RateOfChangeRule, Rule,
+                    RunningStats, ThresholdRule, ZScoreRule)
+
+
+def refresh(engine, values, metric='m'):
+    engine.observe(metric, np.arange(len(values)), values)
+
+
+def test_running_stats_matches_statistics():
+    xs = [3.0, 1.5, 4.0, 1.0, 5.5, 9.0, 2.5]
+    stats = RunningStats()
+    for x in xs:
+        stats.push(x)
+    assert stats.n == len(xs)
+    assert stats.mean == pytest.approx(statistics.mean(xs))
+    assert stats.std == pytest.approx(statistics.stdev(xs))
+
+
+def test_rule_is_abstract():
+    with pytest.raises(TypeError):
+        Rule('r', 'm')
+
+
+def test_threshold_rule():
+    rule = ThresholdRule('r', 'm', above=10, below=0)
+    assert rule.evaluate(5) is None
+    assert 'above' in rule.evaluate(11)
+    assert 'below' in rule.evaluate(-1)
+
+
+def test_rate_of_change_rule():
+    rule = RateOfChangeRule('r', 'm', max_drop=0.2)
+    assert rule.evaluate(100) is None
+    assert rule.evaluate(90) is None
+    assert 'dropped' in rule.evaluate(50)
+
+
+def test_first_refresh_sets_state_without_notifying():
+    sink = LocalSink()
+    engine = AlertEngine([ThresholdRule('r', 'm', above=10)], [sink])
+    refresh(engine, [1, 2, 20, 3])
+    assert sink.sent == []
+    assert [alert['rule'] for alert in engine.firing_alerts()] == ['r']
+
+
+def test_firing_and_resolved_are_sent_once():
+    sink = LocalSink()
+    engine = AlertEngine([ZScoreRule('z', 'm', threshold=3, min_points=5)], [sink])
+    history = [1, 2] * 5
+    refresh(engine, history)
+
+    refresh(engine, history + [50, 60, 1])
+    assert [alert['status'] for alert in sink.sent] == ['firing']
+    assert [alert['rule'] for alert in engine.firing_alerts()] == ['z']
+
+    refresh(engine, history + [50, 60, 1, 2, 1])
+    assert [alert['status'] for alert in sink.sent] == ['firing', 'resolved']
+    assert engine.firing_alerts() == []
+
+
+def test_open_bucket_is_held_back():
+    sink = LocalSink()
+    engine = AlertEngine([ThresholdRule('r', 'm', above=10)], [sink])
+    refresh(engine, [1, 2, 3])
+    # The last bucket is still filling, so its partial value is not evaluated
+    refresh(engine, [1, 2, 3, 20])
+    assert sink.sent == []
+    # Once a newer point arrives, its final value is
+    refresh(engine, [1, 2, 3, 20, 1])
+    assert [alert['value'] for alert in sink.sent] == [20.0]
+
+
+def test_state_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'alerts.json')
+    rules = lambda: [ZScoreRule('z', 'm', threshold=3, min_points=5)]
+    history = [1, 2] * 5
+
+    engine = AlertEngine(rules(), [LocalSink()], state_path=path)
+    refresh(engine, history)
+    engine._lock_file.close()
+
+    # The restarted engine knows the last point and the running stats, so
+    # the spike found on its first refresh is sent
+    sink = LocalSink()
+    restarted = AlertEngine(rules(), [sink], state_path=path)
+    assert restarted.rules['m'][0].stats.n == len(history) - 1
+    refresh(restarted, history + [50, 1])
+    assert [alert['status'] for alert in sink.sent] == ['firing']
+
+
+def test_only_the_lock_holder_notifies(tmp_path):
+    path = str(tmp_path / 'alerts.json')
+    leader_sink, follower_sink = LocalSink(), LocalSink()
+    leader = AlertEngine([ThresholdRule('r', 'm', above=10)], [leader_sink], state_path=path)
+    follower = AlertEngine([ThresholdRule('r', 'm', above=10)], [follower_sink], state_path=path)
+    assert leader.leader and not follower.leader
+
+    for engine in (leader, follower):
+        refresh(engine, [1, 2, 3])
+        refresh(engine, [1, 2, 3, 20, 1])
+    assert len(leader_sink.sent) == 1
+    assert follower_sink.sent == []
+    assert [alert['rule'] for alert in follower.firing_alerts()] == ['r']
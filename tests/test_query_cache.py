@@ -0,0 +1,79 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import query_cache
+from query_cache import _evict, cached_query, fingerprint, normalize_sql
+
+pytest.importorskip('pyarrow')
+
+QUERY = "SELECT COUNT(*) AS blocks FROM block_headers WHERE height >= :start"
+
+
+@pytest.fixture
+def connection(tmp_path, monkeypatch):
+    # Always read the head, instead of reusing it for an epoch
+    monkeypatch.setattr(query_cache, 'HEAD_TTL', 0)
+    engine = create_engine(f"sqlite:///{tmp_path / 'sentinel.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE block_headers (height INTEGER)"))
+    with engine.connect() as conn:
+        yield conn
+
+
+def set_head(connection, head):
+    connection.execute(text("INSERT INTO block_headers VALUES (:head)"), {'head': head})
+    connection.commit()
+
+
+def cache_files(cache_dir):
+    return sorted(f for f in os.listdir(cache_dir) if f.endswith('.parquet'))
+
+
+def test_fingerprint_ignores_whitespace_and_comments():
+    query = """
+        SELECT height  -- the epoch
+        FROM block_headers
+        """
+    assert normalize_sql(query) == "SELECT height FROM block_headers"
+    assert fingerprint(query) == fingerprint("SELECT height\tFROM block_headers")
+    assert fingerprint(QUERY, {'start': 0}) != fingerprint(QUERY, {'start': 1})
+
+
+def test_cache_hits_until_the_head_leaves_the_bucket(connection, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    fp = fingerprint(QUERY, {'start': 0})
+    set_head(connection, 250)
+
+    df = cached_query(connection, QUERY, {'start': 0}, cache_dir=cache_dir, head_bucket=120)
+    assert df.blocks.tolist() == [1]
+    assert cache_files(cache_dir) == [f"{fp}-240.parquet"]
+
+    # Same bucket: the cached frame is returned, not the new count
+    set_head(connection, 300)
+    df = cached_query(connection, QUERY, {'start': 0}, cache_dir=cache_dir, head_bucket=120)
+    assert df.blocks.tolist() == [1]
+
+    # Next bucket: re-run, and the entry of the old head is dropped
+    set_head(connection, 360)
+    df = cached_query(connection, QUERY, {'start': 0}, cache_dir=cache_dir, head_bucket=120)
+    assert df.blocks.tolist() == [3]
+    assert cache_files(cache_dir) == [f"{fp}-360.parquet"]
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path)
+    for i, name in enumerate(['a', 'b', 'c']):
+        path = os.path.join(cache_dir, f"{name}.parquet")
+        with open(path, 'wb') as fid:
+            fid.write(b'x' * 10)
+        os.utime(path, (1000 + i, 1000 + i))
+    # A hit on 'a' makes it the most recently used
+    os.utime(os.path.join(cache_dir, 'a.parquet'), (2000, 2000))
+
+    _evict(cache_dir, max_bytes=10 ** 6, max_entries=2)
+    assert cache_files(cache_dir) == ['a.parquet', 'c.parquet']
+
+    _evict(cache_dir, max_bytes=10, max_entries=10)
+    assert cache_files(cache_dir) == ['a.parquet']
@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+
+import rollups
+from backfill import partitions
+
+METRIC = 'qa_power_velocity_estimate'
+
+
+def buckets(start, end, value=1.0):
+    epochs = list(range(start, end, rollups.EPOCHS_PER_HOUR))
+    return pd.DataFrame({'velocity_estimate': [value] * len(epochs),
+                         'time': [1598306400 + 30 * e for e in epochs],
+                         'epoch': epochs})
+
+
+@pytest.fixture
+def store(tmp_path):
+    return rollups.store_engine(str(tmp_path / 'rollups.sqlite'))
+
+
+def stored_epochs(store):
+    return pd.read_sql(f"SELECT epoch FROM {METRIC} ORDER BY epoch", store).epoch.tolist()
+
+
+def test_partitions_cut_the_last_one_at_the_end():
+    assert partitions(0, 300, 120) == [(0, 120), (120, 240), (240, 300)]
+    assert partitions(240, 240, 120) == []
+
+
+def test_high_water_mark_stops_at_a_gap(store):
+    for start, end in [(0, 120), (120, 240), (360, 480)]:
+        rollups.store_partition(store, METRIC, start, end, buckets(start, end), 1.0)
+    assert rollups.high_water_mark(store, METRIC) == 240
+
+
+def test_extended_last_partition_replaces_its_rows(store):
+    rollups.store_partition(store, METRIC, 0, 240, buckets(0, 240), 1.0)
+    rollups.store_partition(store, METRIC, 240, 360, buckets(240, 360, 1.0), 1.0)
+    # A later run extends the last partition up to a newer head
+    rollups.store_partition(store, METRIC, 240, 600, buckets(240, 600, 2.0), 1.0)
+
+    assert stored_epochs(store) == [0, 120, 240, 360, 480]
+    assert rollups.completed_partitions(store, METRIC) == [(0, 240), (240, 600)]
+    values = pd.read_sql(f"SELECT velocity_estimate FROM {METRIC} WHERE epoch >= 240", store)
+    assert values.velocity_estimate.tolist() == [2.0, 2.0, 2.0]
+
+
+def test_hourly_rollup_joins_store_and_tail_at_the_high_water_mark(store, monkeypatch):
+    for start, end in [(0, 240), (360, 480)]:
+        rollups.store_partition(store, METRIC, start, end, buckets(start, end), 1.0)
+
+    calls = []
+
+    def tail_query(connection, query, params, **kwargs):
+        calls.append(params)
+        return buckets(params['start'], 600, 2.0)
+
+    monkeypatch.setattr(rollups, 'cached_query', tail_query)
+    df = rollups.hourly_rollup(None, METRIC, store)
+
+    assert calls == [{'start': 240, 'end': rollups.MAX_EPOCH}]
+    assert df.epoch.tolist() == [0, 120, 240, 360, 480]
+    assert df.velocity_estimate.tolist() == [1.0, 1.0, 2.0, 2.0, 2.0]
+
+
+def test_hourly_rollup_without_store_queries_everything(monkeypatch):
+    calls = []
+
+    def tail_query(connection, query, params, **kwargs):
+        calls.append(params)
+        return buckets(0, 240)
+
+    monkeypatch.setattr(rollups, 'cached_query', tail_query)
+    df = rollups.hourly_rollup(None, METRIC, None)
+
+    assert calls == [{'start': 0, 'end': rollups.MAX_EPOCH}]
+    assert df.epoch.tolist() == [0, 120]